@@ -1,49 +1,347 @@
 import sqlite3
 import uvicorn
-from fastapi import FastAPI, HTTPException, Depends
-from pydantic import BaseModel
-from contextlib import contextmanager
+from fastapi import FastAPI, HTTPException, Depends, Path, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, ConfigDict, Field
+from concurrent.futures import Future, InvalidStateError
+from contextlib import asynccontextmanager
+from typing import Annotated
+import asyncio
+import math
+import os
+import pathlib
+import queue
 import random
-import string
+import threading
+import time
 import logging
 
-DATABASE_URL = "bank.db"
+DATABASE_URL = os.environ.get("BANK_DATABASE_URL", "bank.db")
+POOL_SIZE = 8
+STATEMENT_CACHE_SIZE = 256
+ACCOUNT_NUMBER_PATTERN = r"^[0-9]{10}$"
+ACCOUNT_NUMBER_MIN = 0
+ACCOUNT_NUMBER_MAX = 10**10 - 1
+ACCOUNT_NUMBER_ATTEMPTS = 5
+GROUP_COMMIT_MAX_BATCH = 64
+GROUP_COMMIT_WINDOW = 0.002
+# Caps a single amount so amount * 100 stays well inside the range where floats are exact
+# integers; balances themselves must fit SQLite's signed 64-bit INTEGER.
+MAX_AMOUNT = 10**12
+MAX_BALANCE_CENTS = 2**63 - 1
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def init_db():
+CONNECTION_PRAGMAS_SCRIPT = """
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-64000;
+PRAGMA mmap_size=268435456;
+PRAGMA busy_timeout=5000;
+"""
+
+ACCOUNTS_TABLE_COLUMNS = """(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account_number INTEGER UNIQUE NOT NULL,
+    account_holder TEXT NOT NULL,
+    balance INTEGER NOT NULL
+)"""
+
+SCHEMA_SCRIPT = f"""
+CREATE TABLE IF NOT EXISTS accounts {ACCOUNTS_TABLE_COLUMNS};
+CREATE INDEX IF NOT EXISTS idx_accounts_lookup ON accounts(account_number, balance, account_holder, id);
+"""
+
+# Databases created before account numbers became integers and balances became cents have
+# TEXT/REAL columns; CREATE TABLE IF NOT EXISTS leaves those alone, so they are rebuilt here.
+# Run one by one inside migrate_legacy_schema's transaction; executescript would commit first.
+LEGACY_MIGRATION_STATEMENTS = (
+    f"CREATE TABLE accounts_migrated {ACCOUNTS_TABLE_COLUMNS}",
+    """INSERT INTO accounts_migrated (id, account_number, account_holder, balance)
+    SELECT id, CAST(account_number AS INTEGER), account_holder, CAST(ROUND(balance * 100) AS INTEGER)
+    FROM accounts""",
+    "DROP TABLE accounts",
+    "ALTER TABLE accounts_migrated RENAME TO accounts",
+)
+
+# Every account query returns columns in Account field order, which account_from_row relies on.
+ACCOUNT_COLUMNS = "id, account_number, account_holder, balance"
+# The UNIQUE autoindex always wins the planner's choice for an equality lookup, so the
+# covering index has to be named explicitly for the lookup to skip the table b-tree.
+SELECT_ACCOUNT_SQL = f"SELECT {ACCOUNT_COLUMNS} FROM accounts INDEXED BY idx_accounts_lookup WHERE account_number = ?"
+INSERT_ACCOUNT_SQL = "INSERT INTO accounts (account_number, account_holder, balance) VALUES (?, ?, ?)"
+ACCOUNT_EXISTS_SQL = "SELECT 1 FROM accounts WHERE account_number = ?"
+DEPOSIT_SQL = (
+    "UPDATE accounts SET balance = balance + ? WHERE account_number = ? AND balance <= ? "
+    f"RETURNING {ACCOUNT_COLUMNS}"
+)
+WITHDRAW_SQL = (
+    "UPDATE accounts SET balance = balance - ? WHERE account_number = ? AND balance >= ? "
+    f"RETURNING {ACCOUNT_COLUMNS}"
+)
+# Moves funds between two accounts in one statement. The debit row is only matched while it
+# can cover the amount and the credit row only while it stays under MAX_BALANCE_CENTS, so
+# both rows come back only when the transfer fully applied.
+TRANSFER_SQL = (
+    "UPDATE accounts SET balance = balance + CASE account_number WHEN ? THEN ? WHEN ? THEN ? END "
+    "WHERE account_number IN (?, ?) AND (account_number != ? OR balance >= ?) "
+    "AND (account_number != ? OR balance <= ?) "
+    "RETURNING account_number"
+)
+
+def is_memory_database(database_url: str) -> bool:
+    return database_url == ":memory:" or "mode=memory" in database_url
+
+def shared_memory_uri(database_url: str) -> str:
+    # A plain in-memory database is private to one connection, so the writer and the
+    # read-only pool would each see their own empty database. A named shared-cache URI
+    # lets every connection in the process open the same one.
+    if database_url == ":memory:":
+        return "file:bank?mode=memory&cache=shared"
+    if "cache=shared" not in database_url:
+        return database_url + "&cache=shared"
+    return database_url
+
+def configure_connection(conn: sqlite3.Connection):
+    # journal_mode is persistent in the database file, so init_db sets it once.
+    conn.executescript(CONNECTION_PRAGMAS_SCRIPT)
+
+def has_legacy_schema(conn: sqlite3.Connection) -> bool:
+    column_types = {row[1]: row[2].upper() for row in conn.execute("PRAGMA table_info(accounts)")}
+    return bool(column_types) and (
+        column_types.get("account_number") != "INTEGER" or column_types.get("balance") != "INTEGER"
+    )
+
+def migrate_legacy_schema(conn: sqlite3.Connection):
+    # The schema is checked under the write lock, so when several workers start against the
+    # same legacy database only the first one rebuilds the table and multiplies balances.
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        conn = sqlite3.connect(DATABASE_URL)
-        cursor = conn.cursor()
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS accounts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            account_number TEXT UNIQUE NOT NULL,
-            account_holder TEXT NOT NULL,
-            balance REAL NOT NULL
-        )
-        """)
+        if has_legacy_schema(conn):
+            logger.warning("Migrating accounts table to integer account numbers and cent balances.")
+            for statement in LEGACY_MIGRATION_STATEMENTS:
+                conn.execute(statement)
         conn.commit()
-        conn.close()
+    except BaseException:
+        conn.rollback()
+        raise
+
+def init_db() -> sqlite3.Connection:
+    # Returns the connection it initialized so it can be reused as the writer connection.
+    conn = None
+    try:
+        conn = open_connection()
+        if not is_memory_database(DATABASE_URL):
+            conn.execute("PRAGMA journal_mode=WAL")
+        migrate_legacy_schema(conn)
+        conn.executescript(SCHEMA_SCRIPT)
         logger.info("Database initialized successfully.")
+        return conn
     except sqlite3.Error as e:
-        logger.error(f"Database initialization failed: {e}")
+        if conn is not None:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.close()
+        logger.error("Database initialization failed: %s", e)
         raise
 
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE_URL)
-    conn.row_factory = sqlite3.Row
+read_only_pool: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=POOL_SIZE)
+
+def open_connection(read_only: bool = False) -> sqlite3.Connection:
+    database, uri = DATABASE_URL, False
+    if is_memory_database(DATABASE_URL):
+        database, uri = shared_memory_uri(DATABASE_URL), True
+    elif read_only:
+        database, uri = pathlib.Path(DATABASE_URL).absolute().as_uri() + "?mode=ro", True
+    # FastAPI runs sync endpoints in a threadpool, so pooled connections move between threads.
+    conn = sqlite3.connect(
+        database,
+        uri=uri,
+        check_same_thread=False,
+        isolation_level=None,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    configure_connection(conn)
+    if read_only:
+        conn.execute("PRAGMA query_only=1")
+        if is_memory_database(DATABASE_URL):
+            # Shared-cache readers get "database table is locked" while a batch is being
+            # written instead of waiting; in-memory databases trade that for dirty reads.
+            conn.execute("PRAGMA read_uncommitted=1")
+    return conn
+
+def init_pool():
+    while not read_only_pool.full():
+        read_only_pool.put(open_connection(read_only=True))
+
+def close_pool():
+    while not read_only_pool.empty():
+        read_only_pool.get().close()
+
+def get_ro_db_connection():
+    conn = read_only_pool.get()
     try:
         yield conn
     finally:
-        conn.close()
+        if conn.in_transaction:
+            conn.rollback()
+        read_only_pool.put(conn)
+
+class GroupCommitWriter:
+    # Owns the only read-write connection. Request threads submit write jobs; the writer
+    # thread runs each batch of jobs in one transaction, so one commit (and one WAL sync)
+    # covers every job in the batch. Each job runs under its own savepoint, so a job that
+    # raises rolls back only its own changes.
+
+    def __init__(self, conn: sqlite3.Connection, max_batch: int = GROUP_COMMIT_MAX_BATCH,
+                 window: float = GROUP_COMMIT_WINDOW):
+        self.conn = conn
+        self.max_batch = max_batch
+        self.window = window
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="sqlite-group-commit", daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, *args) -> Future:
+        future = Future()
+        self.jobs.put((fn, args, future))
+        return future
+
+    def close(self):
+        self.jobs.put(None)
+        self.thread.join()
+
+    def _run(self):
+        running = True
+        while running:
+            job = self.jobs.get()
+            if job is None:
+                break
+            batch = [job]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    job = self.jobs.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if job is None:
+                    running = False
+                    break
+                batch.append(job)
+            # Nothing may escape here: if this thread died, every pending and future write
+            # would wait forever.
+            try:
+                self._commit_batch(batch)
+            except Exception as e:
+                logger.exception("Group commit writer failed on a batch of %d write(s)", len(batch))
+                self._fail_batch(batch, HTTPException(status_code=500, detail=f"Database error: {e}"))
+
+    def _commit_batch(self, batch):
+        outcomes = []
+        try:
+            # The connection context manager commits the batch, or rolls it back if the
+            # transaction itself fails; failed jobs are already undone by their savepoint.
+            with self.conn:
+                self.conn.execute("BEGIN IMMEDIATE")
+                for fn, args, future in batch:
+                    # Skip jobs whose caller already gave up (e.g. the request was cancelled);
+                    # once running, a future can no longer be cancelled.
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    self.conn.execute("SAVEPOINT job")
+                    try:
+                        outcomes.append((future, fn(self.conn, *args), None))
+                    except Exception as e:
+                        self.conn.execute("ROLLBACK TO job")
+                        outcomes.append((future, None, e))
+                    self.conn.execute("RELEASE job")
+        except sqlite3.Error as e:
+            logger.error("Group commit of %d write(s) failed: %s", len(batch), e)
+            self._fail_batch(batch, HTTPException(status_code=500, detail=f"Database error: {e}"))
+            return
+
+        for future, result, error in outcomes:
+            self._deliver(future, result, error)
+
+    def _fail_batch(self, batch, error: Exception):
+        for _, _, future in batch:
+            self._deliver(future, None, error)
+
+    @staticmethod
+    def _deliver(future: Future, result, error: "Exception | None"):
+        try:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+        except InvalidStateError:
+            # Already cancelled or resolved; there is nobody left to tell.
+            pass
+
+db_writer: "GroupCommitWriter | None" = None
+
+def init_writer(conn: sqlite3.Connection):
+    global db_writer
+    db_writer = GroupCommitWriter(conn)
+
+def close_writer():
+    global db_writer
+    if db_writer is not None:
+        db_writer.close()
+        db_writer.conn.close()
+        db_writer = None
+
+def get_db_writer() -> GroupCommitWriter:
+    return db_writer
+
+async def run_write(writer: GroupCommitWriter, fn, *args):
+    try:
+        return await asyncio.wrap_future(writer.submit(fn, *args))
+    except sqlite3.Error as e:
+        logger.error("Database error in %s: %s", fn.__name__, e)
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+
+def generate_account_number() -> int:
+    return random.randrange(ACCOUNT_NUMBER_MIN, ACCOUNT_NUMBER_MAX + 1)
+
+# Balances are stored as integer cents; the API keeps exchanging decimal amounts.
+def to_cents(amount: float) -> int:
+    return round(amount * 100)
+
+def from_cents(cents: int) -> float:
+    return cents / 100
+
+def format_account_number(account_number: int) -> str:
+    # Account numbers are stored as integers but exposed as 10-digit strings; older accounts
+    # can have leading zeros.
+    return f"{account_number:010d}"
 
-def generate_account_number():
-    return ''.join(random.choices(string.digits, k=10))
+def account_from_row(row: tuple) -> "Account":
+    # Rows come straight from our own queries in (id, account_number, account_holder, balance)
+    # order, so validation is skipped.
+    return Account.model_construct(
+        id=row[0], account_number=format_account_number(row[1]), account_holder=row[2],
+        balance=from_cents(row[3])
+    )
+
+# Non-finite or out-of-range amounts are rejected with a 422 instead of overflowing later.
+Amount = Annotated[float, Field(allow_inf_nan=False, ge=-MAX_AMOUNT, le=MAX_AMOUNT)]
+
+# Malformed account numbers in the path are rejected with a 422 before any database work.
+# The path is matched as a string: lax int parsing would also accept signs, padding,
+# underscores and "1234567890.0".
+AccountNumber = Annotated[str, Path(pattern=ACCOUNT_NUMBER_PATTERN)]
+
+# Request bodies reject unknown fields and are immutable once validated.
+REQUEST_MODEL_CONFIG = ConfigDict(extra='forbid', frozen=True)
 
 class AccountCreate(BaseModel):
+    model_config = REQUEST_MODEL_CONFIG
+
     account_holder: str
-    initial_deposit: float = 0.0
+    initial_deposit: Amount = 0.0
 
 class Account(BaseModel):
     id: int
@@ -52,160 +350,189 @@ class Account(BaseModel):
     balance: float
 
 class Transaction(BaseModel):
+    model_config = REQUEST_MODEL_CONFIG
+
+    amount: Amount
+
+class TransferResult(BaseModel):
+    message: str
+    from_account: str
+    to_account: str
     amount: float
 
 class Transfer(BaseModel):
-    from_account_number: str
-    to_account_number: str
-    amount: float
+    model_config = REQUEST_MODEL_CONFIG
+
+    from_account_number: str = Field(pattern=ACCOUNT_NUMBER_PATTERN)
+    to_account_number: str = Field(pattern=ACCOUNT_NUMBER_PATTERN)
+    amount: Amount
+
+def ensure_db(app: FastAPI):
+    if not app.state.initialized:
+        app.state.db_conn = init_db()
+        app.state.initialized = True
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ensure_db(app)
+    # The writer takes over the connection init_db opened, so the WAL index already
+    # exists when the read-only connections attach.
+    init_writer(app.state.db_conn)
+    init_pool()
+    yield
+    close_writer()
+    close_pool()
+    app.state.initialized = False
 
 app = FastAPI(
     title="Simple Bank API",
     description="A simple API to manage bank accounts with deposit, withdrawal, and transfer functionality.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
-
-@app.on_event("startup")
-def on_startup():
-    init_db()
-
-def get_account_by_number(conn: sqlite3.Connection, account_number: str):
+app.state.initialized = False
+
+def replace_non_finite(value):
+    if isinstance(value, float) and not math.isfinite(value):
+        return str(value)
+    if isinstance(value, dict):
+        return {key: replace_non_finite(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [replace_non_finite(item) for item in value]
+    return value
+
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request: Request, exc: RequestValidationError):
+    # The default handler echoes each rejected input back, and Infinity/NaN inputs are not
+    # valid JSON, so those are replaced wherever they occur in the error details.
+    errors = replace_non_finite(jsonable_encoder(exc.errors()))
+    return JSONResponse(status_code=422, content={"detail": errors})
+
+def get_account_by_number(conn: sqlite3.Connection, account_number: int):
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM accounts WHERE account_number = ?", (account_number,))
-        account = cursor.fetchone()
+        account = conn.execute(SELECT_ACCOUNT_SQL, (account_number,)).fetchone()
         if not account:
             raise HTTPException(status_code=404, detail="Account not found")
-        return dict(account)
+        return account_from_row(account)
     except sqlite3.Error as e:
-        logger.error(f"Database error in get_account_by_number: {e}")
+        logger.error("Database error in %s: %s", "get_account_by_number", e)
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
+# The write endpoints are async so validation and serialization stay on the event loop.
+# The _do_* bodies run on the group-commit writer thread inside its open transaction,
+# so they must not commit or roll back themselves; run_write turns database errors into 500s.
+def _do_create_account(conn: sqlite3.Connection, account_holder: str, initial_cents: int):
+    cursor = conn.cursor()
+
+    for attempt in range(ACCOUNT_NUMBER_ATTEMPTS):
+        account_number = generate_account_number()
+        try:
+            cursor.execute(
+                INSERT_ACCOUNT_SQL,
+                (account_number, account_holder, initial_cents)
+            )
+            break
+        except sqlite3.IntegrityError:
+            logger.warning("Account number collision on attempt %d, retrying.", attempt + 1)
+    else:
+        raise HTTPException(status_code=500, detail="Failed to create account: could not allocate a unique account number.")
+    return Account.model_construct(
+        id=cursor.lastrowid,
+        account_number=format_account_number(account_number),
+        account_holder=account_holder,
+        balance=from_cents(initial_cents)
+    )
+
 @app.post("/accounts/", response_model=Account, status_code=201)
-def create_account(account_in: AccountCreate, conn: sqlite3.Connection = Depends(get_db_connection)):
-    if account_in.initial_deposit < 0:
+async def create_account(account_in: AccountCreate, writer: GroupCommitWriter = Depends(get_db_writer)):
+    initial_cents = to_cents(account_in.initial_deposit)
+    if initial_cents < 0:
         raise HTTPException(status_code=400, detail="Initial deposit cannot be negative.")
 
-    account_number = generate_account_number()
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute(
-            "INSERT INTO accounts (account_number, account_holder, balance) VALUES (?, ?, ?)",
-            (account_number, account_in.account_holder, account_in.initial_deposit)
-        )
-        conn.commit()
-        new_account_id = cursor.lastrowid
-        return {
-            "id": new_account_id,
-            "account_number": account_number,
-            "account_holder": account_in.account_holder,
-            "balance": account_in.initial_deposit
-        }
-    except sqlite3.Error as e:
-        conn.rollback()
-        logger.error(f"Failed to create account: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to create account due to a database error: {e}")
+    return await run_write(writer, _do_create_account, account_in.account_holder, initial_cents)
 
 @app.get("/accounts/{account_number}/balance", response_model=Account)
-def check_balance(account_number: str, conn: sqlite3.Connection = Depends(get_db_connection)):
-    account = get_account_by_number(conn, account_number)
+def check_balance(account_number: AccountNumber, conn: sqlite3.Connection = Depends(get_ro_db_connection)):
+    account = get_account_by_number(conn, int(account_number))
     return account
 
+def _do_deposit(conn: sqlite3.Connection, account_number: int, amount_cents: int):
+    account = conn.execute(DEPOSIT_SQL, (amount_cents, account_number, MAX_BALANCE_CENTS - amount_cents)).fetchone()
+    if not account:
+        # Nothing was updated: tell a missing account apart from a balance at its limit.
+        get_account_by_number(conn, account_number)
+        raise HTTPException(status_code=400, detail="Deposit would exceed the maximum account balance.")
+    return account_from_row(account)
+
 @app.post("/accounts/{account_number}/deposit", response_model=Account)
-def deposit(account_number: str, transaction: Transaction, conn: sqlite3.Connection = Depends(get_db_connection)):
-    if transaction.amount <= 0:
+async def deposit(account_number: AccountNumber, transaction: Transaction, writer: GroupCommitWriter = Depends(get_db_writer)):
+    amount_cents = to_cents(transaction.amount)
+    if amount_cents <= 0:
         raise HTTPException(status_code=400, detail="Deposit amount must be positive.")
 
-    account = get_account_by_number(conn, account_number)
-    new_balance = account['balance'] + transaction.amount
+    return await run_write(writer, _do_deposit, int(account_number), amount_cents)
 
-    try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE accounts SET balance = ? WHERE account_number = ?",
-            (new_balance, account_number)
-        )
-        conn.commit()
-    except sqlite3.Error as e:
-        conn.rollback()
-        logger.error(f"Failed to deposit funds: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to deposit funds due to a database error: {e}")
-
-    account['balance'] = new_balance
-    return account
+def _do_withdraw(conn: sqlite3.Connection, account_number: int, amount_cents: int):
+    account = conn.execute(WITHDRAW_SQL, (amount_cents, account_number, amount_cents)).fetchone()
+    if not account:
+        # Nothing was updated: tell a missing account apart from a short balance.
+        get_account_by_number(conn, account_number)
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+    return account_from_row(account)
 
 @app.post("/accounts/{account_number}/withdraw", response_model=Account)
-def withdraw(account_number: str, transaction: Transaction, conn: sqlite3.Connection = Depends(get_db_connection)):
-    if transaction.amount <= 0:
+async def withdraw(account_number: AccountNumber, transaction: Transaction, writer: GroupCommitWriter = Depends(get_db_writer)):
+    amount_cents = to_cents(transaction.amount)
+    if amount_cents <= 0:
         raise HTTPException(status_code=400, detail="Withdrawal amount must be positive.")
 
-    account = get_account_by_number(conn, account_number)
-
-    if account['balance'] < transaction.amount:
-        raise HTTPException(status_code=400, detail="Insufficient funds")
-
-    new_balance = account['balance'] - transaction.amount
-
-    try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE accounts SET balance = ? WHERE account_number = ?",
-            (new_balance, account_number)
-        )
-        conn.commit()
-    except sqlite3.Error as e:
-        conn.rollback()
-        logger.error(f"Failed to withdraw funds: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to withdraw funds due to a database error: {e}")
-
-    account['balance'] = new_balance
-    return account
-
-@app.post("/transfer/", status_code=200)
-def transfer_funds(transfer: Transfer, conn: sqlite3.Connection = Depends(get_db_connection)):
-    if transfer.from_account_number == transfer.to_account_number:
-        raise HTTPException(status_code=400, detail="Cannot transfer funds to the same account.")
-
-    if transfer.amount <= 0:
-        raise HTTPException(status_code=400, detail="Transfer amount must be positive.")
+    return await run_write(writer, _do_withdraw, int(account_number), amount_cents)
 
+def _do_transfer(conn: sqlite3.Connection, transfer: Transfer, amount_cents: int):
+    from_account_number = int(transfer.from_account_number)
+    to_account_number = int(transfer.to_account_number)
     cursor = conn.cursor()
 
-    try:
-        cursor.execute("SELECT * FROM accounts WHERE account_number = ?", (transfer.from_account_number,))
-        from_account = cursor.fetchone()
-        if not from_account:
+    cursor.execute(TRANSFER_SQL, (
+        from_account_number, -amount_cents, to_account_number, amount_cents,
+        from_account_number, to_account_number, from_account_number, amount_cents,
+        to_account_number, MAX_BALANCE_CENTS - amount_cents,
+    ))
+    updated = {row[0] for row in cursor.fetchall()}
+    # Raising rolls the writer's savepoint back, undoing whichever side did apply.
+    if from_account_number not in updated:
+        cursor.execute(ACCOUNT_EXISTS_SQL, (from_account_number,))
+        if not cursor.fetchone():
             raise HTTPException(status_code=404, detail="Sender account not found.")
-        if from_account['balance'] < transfer.amount:
-            raise HTTPException(status_code=400, detail="Insufficient funds in sender account.")
-
-        cursor.execute("SELECT * FROM accounts WHERE account_number = ?", (transfer.to_account_number,))
-        to_account = cursor.fetchone()
-        if not to_account:
+        raise HTTPException(status_code=400, detail="Insufficient funds in sender account.")
+    if to_account_number not in updated:
+        cursor.execute(ACCOUNT_EXISTS_SQL, (to_account_number,))
+        if not cursor.fetchone():
             raise HTTPException(status_code=404, detail="Receiver account not found.")
+        raise HTTPException(status_code=400, detail="Transfer would exceed the receiver's maximum account balance.")
 
-        from_new_balance = from_account['balance'] - transfer.amount
-        to_new_balance = to_account['balance'] + transfer.amount
+@app.post("/transfer/", response_model=TransferResult, status_code=200)
+async def transfer_funds(transfer: Transfer, writer: GroupCommitWriter = Depends(get_db_writer)):
+    if transfer.from_account_number == transfer.to_account_number:
+        raise HTTPException(status_code=400, detail="Cannot transfer funds to the same account.")
 
-        cursor.execute("UPDATE accounts SET balance = ? WHERE account_number = ?", (from_new_balance, transfer.from_account_number))
-        cursor.execute("UPDATE accounts SET balance = ? WHERE account_number = ?", (to_new_balance, transfer.to_account_number))
+    amount_cents = to_cents(transfer.amount)
+    if amount_cents <= 0:
+        raise HTTPException(status_code=400, detail="Transfer amount must be positive.")
 
-        conn.commit()
+    await run_write(writer, _do_transfer, transfer, amount_cents)
 
-        return {
-            "message": "Transfer successful",
-            "from_account": transfer.from_account_number,
-            "to_account": transfer.to_account_number,
-            "amount": transfer.amount
-        }
-    except HTTPException:
-        conn.rollback()
-        raise
-    except sqlite3.Error as e:
-        conn.rollback()
-        logger.error(f"An internal error occurred during the transfer: {e}")
-        raise HTTPException(status_code=500, detail=f"An internal error occurred during the transfer: {e}")
+    return TransferResult.model_construct(
+        message="Transfer successful",
+        from_account=transfer.from_account_number,
+        to_account=transfer.to_account_number,
+        amount=from_cents(amount_cents)
+    )
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
+    # uvicorn imports its own copy of this module as "main", which initializes the database.
+    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
+else:
+    # Schema creation is idempotent, so it runs at import and the startup hook only has to
+    # hand the already-open connection to the writer.
+    ensure_db(app)
\ No newline at end of file
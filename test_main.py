@@ -1,20 +1,29 @@
+import os
 import pytest
 import sqlite3
+import threading
 from fastapi.testclient import TestClient
-from main import app, get_db_connection
+
+# main initializes its database at import; keep that off the real bank.db.
+os.environ["BANK_DATABASE_URL"] = ":memory:"
+
+import main
+from main import app, get_ro_db_connection, get_db_writer, GroupCommitWriter, SCHEMA_SCRIPT
 
 TEST_DATABASE_URL = "file:memdb1?mode=memory&cache=shared"
 
-test_conn = sqlite3.connect(TEST_DATABASE_URL, check_same_thread=False)
-test_conn.row_factory = sqlite3.Row
+test_conn = sqlite3.connect(TEST_DATABASE_URL, check_same_thread=False, isolation_level=None)
 
-def override_get_db_connection():
+def override_get_ro_db_connection():
     try:
         yield test_conn
     finally:
         pass
 
-app.dependency_overrides[get_db_connection] = override_get_db_connection
+test_writer = GroupCommitWriter(test_conn)
+
+app.dependency_overrides[get_ro_db_connection] = override_get_ro_db_connection
+app.dependency_overrides[get_db_writer] = lambda: test_writer
 
 client = TestClient(app)
 
@@ -22,14 +31,7 @@ client = TestClient(app)
 def setup_and_teardown_database():
     cursor = test_conn.cursor()
     cursor.execute("DROP TABLE IF EXISTS accounts")
-    cursor.execute("""
-    CREATE TABLE accounts (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        account_number TEXT UNIQUE NOT NULL,
-        account_holder TEXT NOT NULL,
-        balance REAL NOT NULL
-    )
-    """)
+    cursor.executescript(SCHEMA_SCRIPT)
     test_conn.commit()
     yield
     cursor.execute("DROP TABLE IF EXISTS accounts")
@@ -46,6 +48,17 @@ def test_create_account_successfully():
     assert data["balance"] == 100.0
     assert "account_number" in data
 
+def test_create_account_retries_on_account_number_collision(monkeypatch):
+    numbers = iter([1234567890, 1234567890, 1234567891])
+    monkeypatch.setattr(main, "generate_account_number", lambda: next(numbers))
+
+    first = client.post("/accounts/", json={"account_holder": "Kiran", "initial_deposit": 10.0})
+    second = client.post("/accounts/", json={"account_holder": "Leela", "initial_deposit": 20.0})
+    assert first.status_code == 201
+    assert second.status_code == 201
+    assert first.json()["account_number"] == "1234567890"
+    assert second.json()["account_number"] == "1234567891"
+
 def test_create_account_negative_deposit():
     response = client.post(
         "/accounts/",
@@ -54,6 +67,13 @@ def test_create_account_negative_deposit():
     assert response.status_code == 400
     assert "Initial deposit cannot be negative" in response.json()["detail"]
 
+def test_create_account_rejects_unknown_fields():
+    response = client.post(
+        "/accounts/",
+        json={"account_holder": "Meera", "initial_deposit": 10.0, "balance": 1000000.0}
+    )
+    assert response.status_code == 422
+
 def test_check_balance():
     create_response = client.post("/accounts/", json={"account_holder": "Ashwin", "initial_deposit": 500.0})
     account_number = create_response.json()["account_number"]
@@ -69,6 +89,17 @@ def test_check_balance_not_found():
     assert response.status_code == 404
     assert "Account not found" in response.json()["detail"]
 
+def test_check_balance_malformed_account_number():
+    response = client.get("/accounts/12345/balance")
+    assert response.status_code == 422
+
+    response = client.get("/accounts/not-a-number/balance")
+    assert response.status_code == 422
+
+    for account_number in ["06253012440", "+6253012440", "%206253012440", "6_253012440", "6253012440.0"]:
+        response = client.get(f"/accounts/{account_number}/balance")
+        assert response.status_code == 422, account_number
+
 def test_deposit_successfully():
     create_response = client.post("/accounts/", json={"account_holder": "David", "initial_deposit": 200.0})
     account_number = create_response.json()["account_number"]
@@ -78,6 +109,53 @@ def test_deposit_successfully():
     data = deposit_response.json()
     assert data["balance"] == 350.0
 
+def test_deposit_database_error_returns_500():
+    test_conn.execute("DROP TABLE accounts")
+
+    response = client.post("/accounts/1234567890/deposit", json={"amount": 50.0})
+    assert response.status_code == 500
+    assert "Database error" in response.json()["detail"]
+
+def test_amounts_out_of_range_are_rejected():
+    create_response = client.post("/accounts/", json={"account_holder": "Omar", "initial_deposit": 1e300})
+    assert create_response.status_code == 422
+
+    create_response = client.post("/accounts/", json={"account_holder": "Omar", "initial_deposit": 10.0})
+    account_number = create_response.json()["account_number"]
+
+    response = client.post(f"/accounts/{account_number}/deposit", json={"amount": 1e17})
+    assert response.status_code == 422
+
+    for value in ("Infinity", "NaN"):
+        response = client.post(
+            f"/accounts/{account_number}/deposit",
+            content='{"amount": %s}' % value,
+            headers={"Content-Type": "application/json"}
+        )
+        assert response.status_code == 422
+
+    # Non-finite values nested inside the rejected input are echoed back as strings too.
+    for content in ('{"initial_deposit": NaN}', '[NaN]', '{"account_holder": {"a": NaN}}'):
+        response = client.post("/accounts/", content=content, headers={"Content-Type": "application/json"})
+        assert response.status_code == 422, content
+
+def test_deposit_beyond_maximum_balance():
+    create_response = client.post("/accounts/", json={"account_holder": "Priya", "initial_deposit": 10.0})
+    account_number = create_response.json()["account_number"]
+    test_conn.execute(
+        "UPDATE accounts SET balance = ? WHERE account_number = ?",
+        (main.MAX_BALANCE_CENTS - 100, int(account_number))
+    )
+
+    response = client.post(f"/accounts/{account_number}/deposit", json={"amount": 2.0})
+    assert response.status_code == 400
+    assert "maximum account balance" in response.json()["detail"]
+
+    row = test_conn.execute(
+        "SELECT balance, typeof(balance) FROM accounts WHERE account_number = ?", (int(account_number),)
+    ).fetchone()
+    assert row == (main.MAX_BALANCE_CENTS - 100, "integer")
+
 def test_withdraw_successfully():
     create_response = client.post("/accounts/", json={"account_holder": "Dev", "initial_deposit": 1000.0})
     account_number = create_response.json()["account_number"]
@@ -86,6 +164,25 @@ def test_withdraw_successfully():
     assert withdraw_response.status_code == 200
     assert withdraw_response.json()["balance"] == 700.0
 
+def test_deposit_to_non_existent_account():
+    response = client.post("/accounts/9999999999/deposit", json={"amount": 50.0})
+    assert response.status_code == 404
+    assert "Account not found" in response.json()["detail"]
+
+def test_withdraw_from_non_existent_account():
+    response = client.post("/accounts/9999999999/withdraw", json={"amount": 50.0})
+    assert response.status_code == 404
+    assert "Account not found" in response.json()["detail"]
+
+def test_withdraw_exact_balance_after_fractional_deposits():
+    create_response = client.post("/accounts/", json={"account_holder": "Nila", "initial_deposit": 0.1})
+    account_number = create_response.json()["account_number"]
+
+    client.post(f"/accounts/{account_number}/deposit", json={"amount": 0.2})
+    withdraw_response = client.post(f"/accounts/{account_number}/withdraw", json={"amount": 0.3})
+    assert withdraw_response.status_code == 200
+    assert withdraw_response.json()["balance"] == 0.0
+
 def test_withdraw_insufficient_funds():
     create_response = client.post("/accounts/", json={"account_holder": "Deven", "initial_deposit": 100.0})
     account_number = create_response.json()["account_number"]
@@ -94,6 +191,9 @@ def test_withdraw_insufficient_funds():
     assert withdraw_response.status_code == 400
     assert "Insufficient funds" in withdraw_response.json()["detail"]
 
+    balance_response = client.get(f"/accounts/{account_number}/balance")
+    assert balance_response.json()["balance"] == 100.0
+
 def test_transfer_successfully():
     sender_res = client.post("/accounts/", json={"account_holder": "Joel", "initial_deposit": 1000.0})
     receiver_res = client.post("/accounts/", json={"account_holder": "Wilson", "initial_deposit": 500.0})
@@ -126,6 +226,9 @@ def test_transfer_insufficient_funds():
     assert transfer_response.status_code == 400
     assert "Insufficient funds" in transfer_response.json()["detail"]
 
+    receiver_balance_res = client.get(f"/accounts/{receiver_num}/balance")
+    assert receiver_balance_res.json()["balance"] == 500.0
+
 
 def test_create_account_with_default_deposit():
     response = client.post("/accounts/", json={"account_holder": "Felix"})
@@ -168,6 +271,20 @@ def test_transfer_from_non_existent_account():
     assert response.status_code == 404
     assert "Sender account not found" in response.json()["detail"]
 
+def test_transfer_to_non_existent_account_rolls_back():
+    res = client.post("/accounts/", json={"account_holder": "Irene", "initial_deposit": 100.0})
+    sender_num = res.json()["account_number"]
+
+    response = client.post(
+        "/transfer/",
+        json={"from_account_number": sender_num, "to_account_number": "9999999999", "amount": 50.0}
+    )
+    assert response.status_code == 404
+    assert "Receiver account not found" in response.json()["detail"]
+
+    balance_response = client.get(f"/accounts/{sender_num}/balance")
+    assert balance_response.json()["balance"] == 100.0
+
 def test_transfer_negative_amount():
     sender_res = client.post("/accounts/", json={"account_holder": "Ravi", "initial_deposit": 100.0})
     receiver_res = client.post("/accounts/", json={"account_holder": "Raushan", "initial_deposit": 100.0})
@@ -180,3 +297,190 @@ def test_transfer_negative_amount():
     )
     assert response.status_code == 400
     assert "Transfer amount must be positive" in response.json()["detail"]
+
+def test_transfer_malformed_account_number():
+    res = client.post("/accounts/", json={"account_holder": "Jasmine", "initial_deposit": 100.0})
+    sender_num = res.json()["account_number"]
+
+    response = client.post(
+        "/transfer/",
+        json={"from_account_number": sender_num, "to_account_number": "12AB", "amount": 50.0}
+    )
+    assert response.status_code == 422
+
+def test_group_commit_rolls_back_only_the_failed_job():
+    def insert(conn, account_number):
+        conn.execute(
+            "INSERT INTO accounts (account_number, account_holder, balance) VALUES (?, 'Batch', 0)",
+            (account_number,)
+        )
+
+    def insert_then_fail(conn, account_number):
+        insert(conn, account_number)
+        raise ValueError("boom")
+
+    futures = [
+        test_writer.submit(insert, 1000000001),
+        test_writer.submit(insert_then_fail, 1000000002),
+        test_writer.submit(insert, 1000000003),
+    ]
+    assert futures[0].result() is None
+    with pytest.raises(ValueError):
+        futures[1].result()
+    assert futures[2].result() is None
+
+    rows = test_conn.execute("SELECT account_number FROM accounts ORDER BY account_number").fetchall()
+    assert [row[0] for row in rows] == [1000000001, 1000000003]
+
+def test_group_commit_skips_cancelled_job_and_keeps_running():
+    release = threading.Event()
+    ran = []
+
+    def block(conn):
+        release.wait(timeout=5)
+
+    def record(conn, name):
+        ran.append(name)
+        return name
+
+    blocker = test_writer.submit(block)
+    cancelled = test_writer.submit(record, "cancelled")
+    assert cancelled.cancel()
+    release.set()
+    blocker.result(timeout=5)
+
+    assert test_writer.submit(record, "later").result(timeout=5) == "later"
+    assert ran == ["later"]
+    assert test_writer.thread.is_alive()
+
+def use_legacy_database(tmp_path, monkeypatch, rows):
+    # Points main at a database in the pre-integer schema: TEXT account numbers, REAL dollars.
+    database = tmp_path / "legacy.db"
+    legacy_conn = sqlite3.connect(database)
+    legacy_conn.execute("""
+    CREATE TABLE accounts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_number TEXT UNIQUE NOT NULL,
+        account_holder TEXT NOT NULL,
+        balance REAL NOT NULL
+    )
+    """)
+    legacy_conn.executemany(
+        "INSERT INTO accounts (account_number, account_holder, balance) VALUES (?, ?, ?)", rows
+    )
+    legacy_conn.commit()
+    legacy_conn.close()
+    monkeypatch.setattr(main, "DATABASE_URL", str(database))
+
+def test_init_db_migrates_legacy_schema(tmp_path, monkeypatch):
+    use_legacy_database(tmp_path, monkeypatch, [("1111111111", "Ruth", 12.34)])
+
+    conn = main.init_db()
+    try:
+        row = conn.execute(
+            "SELECT id, account_number, typeof(account_number), balance, typeof(balance) FROM accounts"
+        ).fetchone()
+        assert row == (1, 1111111111, "integer", 1234, "integer")
+        assert not main.has_legacy_schema(conn)
+
+        cursor = conn.execute(main.INSERT_ACCOUNT_SQL, (2222222222, "Sam", 0))
+        assert cursor.lastrowid == 2
+    finally:
+        conn.close()
+
+def test_legacy_migration_runs_once_across_connections(tmp_path, monkeypatch):
+    use_legacy_database(tmp_path, monkeypatch, [("1111111111", "Ruth", 12.34)])
+
+    # Two workers opened against the legacy database; the second one finds it already migrated.
+    first_conn, second_conn = main.open_connection(), main.open_connection()
+    try:
+        main.migrate_legacy_schema(first_conn)
+        main.migrate_legacy_schema(second_conn)
+        assert second_conn.execute("SELECT balance FROM accounts").fetchone() == (1234,)
+        assert not second_conn.in_transaction
+    finally:
+        first_conn.close()
+        second_conn.close()
+
+def test_transfer_on_migrated_text_schema_database(tmp_path, monkeypatch):
+    use_legacy_database(tmp_path, monkeypatch, [("1111111111", "Tara", 100.0), ("2222222222", "Uma", 5.0)])
+
+    writer = GroupCommitWriter(main.init_db())
+    try:
+        transfer = main.Transfer(from_account_number="1111111111", to_account_number="2222222222", amount=40.0)
+        writer.submit(main._do_transfer, transfer, 4000).result(timeout=5)
+        rows = writer.conn.execute("SELECT account_number, balance FROM accounts ORDER BY id").fetchall()
+        assert rows == [(1111111111, 6000), (2222222222, 4500)]
+    finally:
+        writer.close()
+        writer.conn.close()
+
+def test_migrated_leading_zero_account_stays_reachable(tmp_path, monkeypatch):
+    use_legacy_database(tmp_path, monkeypatch, [("0123456789", "Wren", 30.0), ("2222222222", "Xia", 0.0)])
+
+    writer = GroupCommitWriter(main.init_db())
+    try:
+        def override_read_connection():
+            yield writer.conn
+
+        monkeypatch.setattr(app, "dependency_overrides", {
+            get_ro_db_connection: override_read_connection,
+            get_db_writer: lambda: writer,
+        })
+
+        balance_response = client.get("/accounts/0123456789/balance")
+        assert balance_response.status_code == 200
+        assert balance_response.json()["account_number"] == "0123456789"
+        assert balance_response.json()["balance"] == 30.0
+
+        transfer_response = client.post(
+            "/transfer/",
+            json={"from_account_number": "0123456789", "to_account_number": "2222222222", "amount": 10.0}
+        )
+        assert transfer_response.status_code == 200
+        assert client.get("/accounts/0123456789/balance").json()["balance"] == 20.0
+    finally:
+        writer.close()
+        writer.conn.close()
+
+def test_lifespan_serves_reads_from_read_only_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "DATABASE_URL", str(tmp_path / "bank.db"))
+    monkeypatch.setattr(app, "dependency_overrides", {})
+    monkeypatch.setattr(app.state, "initialized", False)
+    monkeypatch.setattr(app.state, "db_conn", app.state.db_conn)
+
+    with TestClient(app) as lifespan_client:
+        create_response = lifespan_client.post("/accounts/", json={"account_holder": "Vera", "initial_deposit": 75.0})
+        assert create_response.status_code == 201
+        account_number = create_response.json()["account_number"]
+
+        balance_response = lifespan_client.get(f"/accounts/{account_number}/balance")
+        assert balance_response.status_code == 200
+        assert balance_response.json()["balance"] == 75.0
+
+        assert main.read_only_pool.full()
+        conn = main.read_only_pool.get()
+        try:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            with pytest.raises(sqlite3.OperationalError):
+                conn.execute("UPDATE accounts SET balance = 0")
+        finally:
+            main.read_only_pool.put(conn)
+
+    assert main.read_only_pool.empty()
+    assert main.db_writer is None
+
+def test_lifespan_shares_in_memory_database_with_read_only_pool(monkeypatch):
+    monkeypatch.setattr(main, "DATABASE_URL", ":memory:")
+    monkeypatch.setattr(app, "dependency_overrides", {})
+    monkeypatch.setattr(app.state, "initialized", False)
+    monkeypatch.setattr(app.state, "db_conn", app.state.db_conn)
+
+    with TestClient(app) as lifespan_client:
+        create_response = lifespan_client.post("/accounts/", json={"account_holder": "Yusuf", "initial_deposit": 40.0})
+        assert create_response.status_code == 201
+        account_number = create_response.json()["account_number"]
+
+        balance_response = lifespan_client.get(f"/accounts/{account_number}/balance")
+        assert balance_response.status_code == 200
+        assert balance_response.json()["balance"] == 40.0